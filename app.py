@@ -4,16 +4,41 @@
 # SEÇÃO DE IMPORTAÇÕES
 # ---------------------------------------------------------------------------
 # Importa as classes e funções necessárias das bibliotecas.
-from flask import Flask, render_template, session, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, session, request, redirect, url_for, flash, jsonify, make_response
 from flask_sqlalchemy import SQLAlchemy  # ORM para interagir com o banco de dados
 import os  # Para acessar variáveis de ambiente (chaves, senhas, etc.)
+import io  # Para montar buffers de texto em memória (usado no COPY do PostgreSQL)
+import csv  # Para serializar linhas no formato aceito pelo COPY
+import hmac  # Para comparar credenciais de login em tempo constante
 import json  # Para manipular dados no formato JSON (usado nas credenciais do Google)
-from datetime import datetime  # Para trabalhar com datas e horas
-from functools import wraps  # Ferramenta para criar 'decorators' (usado no login_required)
-import requests  # (Não utilizado no código, mas geralmente para fazer requisições HTTP)
+import re  # Para reconhecer os formatos de data da planilha com expressões regulares
+import threading  # Para sincronizar a criação do serviço do Google entre threads
+import time  # Para controlar o intervalo mínimo entre sincronizações com a planilha
+from datetime import datetime, date, timedelta  # Para trabalhar com datas e horas
+from functools import wraps  # Ferramenta para construir 'decorators'
+import requests  # Para requisições HTTP diretas (exportação CSV da planilha)
+
+# Importa o INSERT específico do PostgreSQL, que suporta "ON CONFLICT DO NOTHING"
+# (usado para deixar o banco descartar pacientes duplicados na sincronização).
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+# 'load_only' restringe as colunas carregadas em uma consulta (usado na listagem
+# de pacientes, que só exibe algumas colunas da tabela) e 'joinedload' traz
+# relacionamentos na mesma consulta (usado no resumo do paciente).
+from sqlalchemy.orm import load_only, joinedload, raiseload, undefer, undefer_group
+
+# 'func' e 'select' são usados para montar a consulta barata que resume o
+# estado dos dados (contagens e maior id) para o ETag da listagem.
+from sqlalchemy import exists, func, select
+# 'lambda_stmt' embrulha a construção da consulta em um lambda: o SQLAlchemy
+# compila o SQL uma única vez por "forma" da consulta e, nas execuções
+# seguintes, só troca os parâmetros — a montagem Python da consulta some do
+# caminho quente.
+from sqlalchemy import lambda_stmt
 
 # Importa as bibliotecas do Google para interagir com a API do Google Sheets
 from google.oauth2 import service_account
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from googleapiclient.discovery import build
 
 # ---------------------------------------------------------------------------
@@ -31,19 +56,45 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
 # Desativa uma funcionalidade do SQLAlchemy que rastreia modificações, economizando recursos.
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Ajusta o pool de conexões do SQLAlchemy para o PostgreSQL: mantém conexões
+# quentes entre requisições (evitando o handshake TCP+TLS+autenticação a cada
+# acesso), absorve picos com 'max_overflow', descarta conexões mortas antes de
+# usá-las ('pool_pre_ping') e recicla conexões antigas antes que o servidor as
+# derrube por inatividade ('pool_recycle'). O SQLite (usado em desenvolvimento)
+# não usa essas opções, por isso o condicional.
+if (os.getenv('SQLALCHEMY_DATABASE_URI') or '').startswith('postgres'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        # Tempo máximo (s) esperando por uma conexão livre antes de falhar com
+        # erro claro, em vez de pendurar a requisição indefinidamente.
+        'pool_timeout': 30,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        # psycopg2: envia vários conjuntos de VALUES por pacote de rede nos
+        # INSERTs em massa, em vez de uma ida e volta por linha.
+        'executemany_mode': 'values_plus_batch',
+    }
+
 # Define a chave secreta da aplicação, também pega de uma variável de ambiente.
 # Essencial para gerenciar sessões de usuário (manter o login).
 app.secret_key = os.getenv('secret_key')
 
 # Importa os modelos de dados (tabelas) do arquivo 'models.py' e inicializa o banco.
-from models import db, FormResponse, CaseEvaluation, Authorization, ProcedureExecution, FollowUp
+from models import db, FormResponse, CaseEvaluation, Authorization, ProcedureExecution, FollowUp, Location, Requester
 db.init_app(app)
 
 # Cria todas as tabelas no banco de dados, caso elas ainda não existam.
 # 'with app.app_context()' garante que a aplicação Flask esteja configurada corretamente
 # antes de tentar interagir com o banco de dados.
-with app.app_context():
-    db.create_all()
+# Só roda quando a variável de ambiente RUN_CREATE_ALL=1: o 'create_all'
+# inspeciona a existência de cada tabela no banco (uma ida e volta por tabela),
+# e com vários workers em produção esse custo seria pago em cada boot, sem
+# necessidade — o esquema já existe. Ligue a variável apenas no primeiro deploy
+# ou após mudar os modelos.
+if os.getenv('RUN_CREATE_ALL') == '1':
+    with app.app_context():
+        db.create_all()
 
 # ---------------------------------------------------------------------------
 # CONFIGURAÇÕES DA API DO GOOGLE SHEETS
@@ -56,34 +107,206 @@ RANGE_NAME = 'Respostas ao formulário 1!A:K'
 # Conteúdo do arquivo JSON de credenciais, armazenado como uma variável de ambiente.
 CREDENTIALS_FILE = os.getenv('CREDENTIALS_FILE')
 
+# Quantidade de pacientes exibidos por página na listagem.
+PAGE_SIZE = 50
+
+# Quando ligado, as consultas de leitura recebem 'raiseload("*")': qualquer
+# carregamento preguiçoso (lazy load) que um refactor futuro reintroduza nas
+# rotas de leitura vira uma exceção imediata, em vez de um N+1 silencioso em
+# produção. Não há custo em tempo de execução enquanto nenhum lazy load
+# dispara; desligue com STRICT_LAZY_LOADS=0 se precisar de uma válvula de
+# escape em produção.
+STRICT_LAZY_LOADS = os.getenv('STRICT_LAZY_LOADS', '1') == '1'
+
 # Define os "escopos" de permissão. Aqui, estamos pedindo permissão para ler e escrever em planilhas.
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
+# Faz o parse do JSON de credenciais e constrói o objeto de credenciais UMA vez,
+# na carga do módulo, em vez de a cada chamada à API. Se a variável de ambiente
+# não estiver definida (ex: desenvolvimento sem acesso à planilha), fica None e
+# o erro só é levantado quando alguém realmente tentar usar o serviço.
+if CREDENTIALS_FILE:
+    _CREDENTIALS_INFO = json.loads(CREDENTIALS_FILE)
+    _CREDS = service_account.Credentials.from_service_account_info(
+        _CREDENTIALS_INFO,
+        scopes=SCOPES
+    )
+else:
+    _CREDENTIALS_INFO = None
+    _CREDS = None
+
+
+# ---------------------------------------------------------------------------
+# CACHE DE CONSULTAS COM TTL E INVALIDAÇÃO POR VERSÃO
+# ---------------------------------------------------------------------------
+# Consultas de painel repetem o mesmo SQL sobre dados que mudam raramente.
+# O decorator 'cached_query' memoiza o resultado por alguns segundos; a chave
+# inclui um número de versão que é incrementado a cada flush de escrita no
+# banco, então qualquer escrita feita por este processo invalida o cache na
+# hora (a invalidação é O(1): basta a versão mudar). Cache em memória do
+# próprio processo — suficiente para este deploy; um Redis compartilhado só
+# valeria a pena com vários workers de longa duração.
+
+_query_cache = {}
+_query_cache_lock = threading.Lock()
+_db_version = 0
+
+def _bump_db_version(session):
+    """Invalida o cache de consultas quando uma transação é confirmada."""
+    global _db_version
+    _db_version += 1
+
+def cached_query(ttl=60):
+    """
+    Decorator que memoiza o retorno da função por até 'ttl' segundos, ou menos
+    se houver uma escrita no banco nesse meio-tempo. A função decorada deve ser
+    determinística em relação aos seus argumentos (que precisam ser hasháveis).
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args):
+            key = (f.__name__, args, _db_version)
+            now = time.monotonic()
+            with _query_cache_lock:
+                hit = _query_cache.get(key)
+                if hit is not None and now - hit[0] < ttl:
+                    return hit[1]
+            result = f(*args)
+            with _query_cache_lock:
+                # Descarta entradas de versões antigas para o cache não crescer.
+                stale = [k for k in _query_cache if k[2] != _db_version]
+                for k in stale:
+                    del _query_cache[k]
+                _query_cache[key] = (now, result)
+            return result
+        return wrapper
+    return decorator
+
+# Registra o incremento de versão em todo commit. O gatilho é o commit (e não
+# o flush) para cobrir também as escritas via Core — INSERT em massa, COPY e
+# ON CONFLICT — que não passam pelo unit-of-work do ORM.
+from sqlalchemy import event as _sa_event
+_sa_event.listen(db.session, 'after_commit', _bump_db_version)
 
 # ---------------------------------------------------------------------------
 # FUNÇÕES DE INTERAÇÃO COM O GOOGLE SHEETS
 # ---------------------------------------------------------------------------
 
+# Guarda o serviço autenticado do Google Sheets após a primeira criação.
+# Construir o serviço é caro (parse do JSON de credenciais + handshake TLS +
+# leitura do documento de descoberta da API), então fazemos isso apenas uma vez
+# e reutilizamos o mesmo objeto em todas as chamadas seguintes.
+_SHEETS_SERVICE = None
+# Lock que impede duas threads de construírem o serviço ao mesmo tempo.
+_SHEETS_SERVICE_LOCK = threading.Lock()
+
 def get_google_sheet_service():
     """
     Autentica e cria o objeto de serviço para interagir com a API do Google Sheets.
     Usa as credenciais de uma conta de serviço armazenadas em uma variável de ambiente.
+    O serviço é criado apenas na primeira chamada e reutilizado depois (singleton).
+    """
+    global _SHEETS_SERVICE
+
+    # Caminho rápido: se o serviço já foi criado, apenas o retorna.
+    if _SHEETS_SERVICE is not None:
+        return _SHEETS_SERVICE
+
+    with _SHEETS_SERVICE_LOCK:
+        # Verifica novamente dentro do lock: outra thread pode ter criado o
+        # serviço enquanto esta esperava.
+        if _SHEETS_SERVICE is None:
+            # 1. Verifica se as credenciais foram carregadas na inicialização.
+            if _CREDS is None:
+                raise ValueError("A variável de ambiente 'CREDENTIALS_FILE' não foi definida ou está vazia.")
+
+            # 2. Constrói o objeto de serviço que será usado para fazer as chamadas à API,
+            # reutilizando as credenciais já construídas na carga do módulo.
+            # 'static_discovery=False' evita depender do documento de descoberta embutido.
+            _SHEETS_SERVICE = build('sheets', 'v4', credentials=_CREDS,
+                                    cache_discovery=False, static_discovery=False)
+
+    return _SHEETS_SERVICE
+
+def fetch_sheet_csv():
+    """
+    Lê as linhas da planilha pelo endpoint de exportação CSV ('gviz', com o
+    token da conta de serviço). O CSV é um fluxo compacto — sem o envelope
+    JSON célula a célula da API de valores, o payload cai quase pela metade —
+    e o módulo 'csv' do Python faz o parse em C. Retorna a lista de linhas,
+    incluindo o cabeçalho, no mesmo formato da API de valores.
     """
-    # 1. Verifica se a variável de ambiente com as credenciais foi definida.
-    if not CREDENTIALS_FILE:
+    if _CREDS is None:
         raise ValueError("A variável de ambiente 'CREDENTIALS_FILE' não foi definida ou está vazia.")
 
-    # 2. Converte a string JSON da variável de ambiente para um dicionário Python.
-    credentials_info = json.loads(CREDENTIALS_FILE)
+    # Garante um token de acesso válido para autenticar o GET.
+    if not _CREDS.valid:
+        _CREDS.refresh(GoogleAuthRequest())
 
-    # 3. Cria o objeto de credenciais a partir do dicionário.
-    creds = service_account.Credentials.from_service_account_info(
-        credentials_info,
-        scopes=SCOPES
+    response = requests.get(
+        f'https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}/gviz/tq',
+        params={'tqx': 'out:csv', 'sheet': 'Respostas ao formulário 1'},
+        headers={'Authorization': f'Bearer {_CREDS.token}'},
+        timeout=30
     )
-    
-    # 4. Constrói e retorna o objeto de serviço que será usado para fazer as chamadas à API.
-    return build('sheets', 'v4', credentials=creds, cache_discovery=False)
+    response.raise_for_status()
+    return list(csv.reader(io.StringIO(response.text)))
+
+def get_sheet_values():
+    """
+    Lê as linhas da planilha pedindo o mínimo possível à API: o 'fields' corta
+    todos os metadados da resposta (formatação, propriedades) e o
+    'valueRenderOption=UNFORMATTED_VALUE' devolve os valores crus, sem a
+    formatação de exibição — o payload JSON encolhe bastante. Com valores
+    crus, as datas chegam como números seriais do Sheets, que 'parse_date'
+    também sabe converter.
+    """
+    service = get_google_sheet_service()
+    result = service.spreadsheets().values().batchGet(
+        spreadsheetId=SPREADSHEET_ID,
+        ranges=[RANGE_NAME],
+        majorDimension='ROWS',
+        valueRenderOption='UNFORMATTED_VALUE',
+        fields='valueRanges/values'
+    ).execute()
+    value_ranges = result.get('valueRanges', [])
+    if not value_ranges:
+        return []
+    return value_ranges[0].get('values', [])
+
+# Ordem das colunas usada pelo caminho rápido de COPY (deve bater com a tabela).
+_FORM_RESPONSE_COPY_COLUMNS = (
+    'email', 'patient_full_name', 'patient_age', 'patient_contact',
+    'referral_date', 'internment_type', 'location_id', 'procedure',
+    'diagnosis', 'condition_severity'
+)
+
+# A partir de quantas linhas novas o caminho de COPY passa a valer a pena.
+_COPY_THRESHOLD = 100
+
+def _copy_form_responses(rows_to_insert):
+    """
+    Insere um lote grande de respostas usando o comando COPY do PostgreSQL,
+    que é várias vezes mais rápido que INSERTs em massa para milhares de linhas
+    (carga inicial ou migração). Serializa as linhas como CSV em memória e
+    envia tudo em um único comando pela conexão da sessão atual.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter='\t', quoting=csv.QUOTE_MINIMAL)
+    for row in rows_to_insert:
+        writer.writerow([row[column] for column in _FORM_RESPONSE_COPY_COLUMNS])
+    buffer.seek(0)
+
+    # Acessa a conexão "crua" do psycopg2 por baixo da sessão do SQLAlchemy,
+    # para que o COPY participe da mesma transação do commit final.
+    raw_connection = db.session.connection().connection
+    with raw_connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY form_response ({}) FROM STDIN WITH (FORMAT CSV, DELIMITER E'\\t')".format(
+                ', '.join(_FORM_RESPONSE_COPY_COLUMNS)
+            ),
+            buffer
+        )
 
 def fetch_responses():
     """
@@ -91,13 +314,14 @@ def fetch_responses():
     e insere apenas as que forem novas.
     """
     try:
-        # Obtém o serviço autenticado do Google Sheets.
-        service = get_google_sheet_service()
-        sheet = service.spreadsheets()
-
-        # Executa a chamada à API para obter os valores da planilha.
-        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range=RANGE_NAME).execute()
-        responses = result.get('values', []) # Pega a lista de linhas; se não houver, retorna lista vazia.
+        # Obtém os valores da planilha. Tenta primeiro a exportação CSV (payload
+        # menor, parse em C); se ela falhar por qualquer motivo, cai para a API
+        # de valores normal.
+        try:
+            responses = fetch_sheet_csv()
+        except Exception as e:
+            print(f"Exportação CSV indisponível ({e}); usando a API de valores.")
+            responses = get_sheet_values()
 
         # Se a planilha estiver vazia, imprime um aviso e encerra a função.
         if not responses:
@@ -105,45 +329,93 @@ def fetch_responses():
             return 0
 
         # Ignora a primeira linha (cabeçalho da tabela).
-        responses = responses[1:] 
+        responses = responses[1:]
         new_entries = 0 # Contador para novas entradas.
 
-        # Itera sobre cada linha de resposta da planilha.
+        # Carrega de uma só vez todos os nomes de pacientes já cadastrados.
+        # Uma única consulta substitui uma consulta por linha da planilha, e a
+        # verificação de duplicidade vira um teste de pertinência em O(1).
+        existing_names = set(
+            db.session.execute(
+                lambda_stmt(lambda: select(FormResponse.patient_full_name))
+            ).scalars()
+        )
+
+        # Acumula as linhas novas como dicionários simples. Inserir tudo de uma
+        # vez com 'bulk_insert_mappings' evita o custo por objeto do ORM
+        # (identity map, eventos) que 'db.session.add' pagaria linha a linha.
+        rows_to_insert = []
+
+        # Passada de validação separada: filtra as linhas pelo número de
+        # colunas (avisando sobre as incompletas) de uma vez só, e o laço de
+        # conversão abaixo fica livre de desvios para o caso comum.
+        complete_rows = []
         for row in responses:
-            # Pula a linha se ela não tiver o número mínimo de colunas esperadas (11).
-            if len(row) < 11:
+            if len(row) >= 11:
+                complete_rows.append(row)
+            else:
                 print(f"Erro: Linha incompleta -> {row}")
-                continue
-            
+
+        # Itera sobre cada linha de resposta completa da planilha.
+        for row in complete_rows:
             # Verifica se já existe um paciente com o mesmo nome no banco de dados.
             # 'row[2]' corresponde à coluna do nome completo do paciente.
-            existing_patient = FormResponse.query.filter_by(patient_full_name=row[2]).first()
-            if existing_patient:
+            name = row[2]
+            if name in existing_names:
                 continue # Se já existe, pula para a próxima linha.
 
-            # Se o paciente é novo, cria um objeto 'FormResponse' com os dados da linha.
+            # Se o paciente é novo, monta o dicionário com os dados da linha.
             try:
-                response = FormResponse(
-                    email=row[1],
-                    patient_full_name=row[2],
-                    patient_age=int(row[3]),
-                    patient_contact=str(row[4]),
-                    referral_date=parse_date(row[5]), # Usa a função auxiliar para converter a data.
-                    internment_type=row[6],
-                    location=row[7],
-                    procedure=row[8],
-                    diagnosis=row[9],
-                    condition_severity=row[10]
-                )
-                # Adiciona o novo objeto à sessão do banco de dados (prepara para salvar).
-                db.session.add(response)
+                rows_to_insert.append({
+                    'email': row[1],
+                    'patient_full_name': name,
+                    'patient_age': int(row[3]),
+                    'patient_contact': str(row[4]),
+                    'referral_date': parse_date(row[5]), # Usa a função auxiliar para converter a data.
+                    'internment_type': row[6],
+                    'location': row[7],
+                    'procedure': row[8],
+                    'diagnosis': row[9],
+                    'condition_severity': row[10]
+                })
+                # Registra o nome no conjunto para que linhas duplicadas dentro
+                # da própria planilha também sejam ignoradas.
+                existing_names.add(name)
                 new_entries += 1
             except Exception as e:
                 # Captura e informa erros que possam ocorrer durante a conversão dos dados da linha.
                 print(f"Erro ao processar a linha {row}: {e}")
 
-        # Salva todas as novas entradas adicionadas no banco de dados.
-        db.session.commit()
+        # Insere todas as novas entradas de uma só vez e salva no banco de dados.
+        # Para lotes grandes no PostgreSQL, usa o caminho rápido de COPY;
+        # nos demais casos (SQLite, lotes pequenos), o bulk insert já basta.
+        if rows_to_insert:
+            # Resolve os nomes de localização nos ids da tabela de consulta
+            # (duas consultas no total, para qualquer tamanho de lote) e troca
+            # o texto pelo id em cada linha antes da inserção.
+            location_ids = Location.ids_for(
+                {row['location'] for row in rows_to_insert})
+            for row in rows_to_insert:
+                row['location_id'] = location_ids[row.pop('location')]
+
+            dialect = db.session.get_bind().dialect.name
+            if dialect == 'postgresql' and len(rows_to_insert) > _COPY_THRESHOLD:
+                _copy_form_responses(rows_to_insert)
+            elif dialect == 'postgresql':
+                # No PostgreSQL, a restrição única 'uq_patient_full_name' permite
+                # delegar a deduplicação ao banco: um único INSERT com
+                # "ON CONFLICT DO NOTHING" descarta duplicados de forma atômica,
+                # mesmo que outra sincronização esteja rodando ao mesmo tempo.
+                db.session.execute(
+                    pg_insert(FormResponse.__table__)
+                    .values(rows_to_insert)
+                    .on_conflict_do_nothing(index_elements=['patient_full_name'])
+                )
+            else:
+                # Caminho de INSERT em massa do SQLAlchemy 2.0 (ver o método
+                # no modelo): um único execute para o lote inteiro.
+                FormResponse.bulk_import(rows_to_insert)
+            db.session.commit()
         return new_entries
 
     except Exception as e:
@@ -151,11 +423,58 @@ def fetch_responses():
         print(f"Erro ao buscar dados do Google Sheets: {e}")
         return 0
 
+# Intervalo mínimo (em segundos) entre duas sincronizações com a planilha.
+# Dentro desse intervalo, '/listpatient' é servido só com o banco de dados,
+# sem nenhuma chamada à API do Google no caminho da requisição.
+SYNC_INTERVAL_SECONDS = int(os.getenv('SYNC_INTERVAL_SECONDS', '60'))
+
+# Momento da última sincronização e lock para evitar sincronizações simultâneas.
+_last_sync_time = 0.0
+_sync_lock = threading.Lock()
+
+def sync_responses_if_stale():
+    """
+    Executa 'fetch_responses' no máximo uma vez a cada SYNC_INTERVAL_SECONDS.
+    Chamadas dentro do intervalo (ou enquanto outra sincronização está em
+    andamento) retornam imediatamente, de modo que a página de listagem quase
+    nunca espera pela rede do Google.
+    """
+    global _last_sync_time
+
+    # Caminho rápido: sincronizou há pouco tempo, nada a fazer.
+    if time.monotonic() - _last_sync_time < SYNC_INTERVAL_SECONDS:
+        return 0
+
+    # Se outra requisição já está sincronizando, não espera por ela.
+    if not _sync_lock.acquire(blocking=False):
+        return 0
+
+    try:
+        new_entries = fetch_responses()
+        _last_sync_time = time.monotonic()
+        return new_entries
+    finally:
+        _sync_lock.release()
+
+# Guarda o ID numérico da aba após a primeira busca bem-sucedida (o valor
+# nunca muda). Mesmo padrão de singleton de '_SHEETS_SERVICE': a variável só é
+# atribuída em caso de sucesso, então uma falha transitória da API não fica
+# memorizada — a próxima chamada tenta de novo.
+_SHEET_ID = None
+
 def get_sheet_id():
     """
     Obtém o ID numérico da aba (sheet) específica pelo seu nome.
     Este ID é necessário para operações como deletar uma linha.
+    O resultado nunca muda, então é memoizado após a primeira busca que der
+    certo; falhas retornam None sem poluir o cache.
     """
+    global _SHEET_ID
+
+    # Caminho rápido: se o ID já foi descoberto, apenas o retorna.
+    if _SHEET_ID is not None:
+        return _SHEET_ID
+
     try:
         service = get_google_sheet_service()
         # Obtém os metadados da planilha inteira.
@@ -165,7 +484,8 @@ def get_sheet_id():
         # Procura a aba com o título "Respostas ao formulário 1".
         for sheet in sheets:
             if sheet["properties"]["title"] == "Respostas ao formulário 1":
-                return sheet["properties"]["sheetId"] # Retorna o ID encontrado.
+                _SHEET_ID = sheet["properties"]["sheetId"]
+                return _SHEET_ID # Retorna o ID encontrado.
 
         print("Erro: Aba 'Respostas ao formulário 1' não foi encontrada.")
         return None
@@ -174,29 +494,53 @@ def get_sheet_id():
         print(f"Ocorreu um erro ao tentar obter o sheetId: {e}")
         return None
 
+# Expressões regulares pré-compiladas para os dois formatos de data que a
+# planilha gera. Casar uma regex e converter os grupos com int() é cerca de uma
+# ordem de grandeza mais rápido que 'datetime.strptime' (que reinterpreta a
+# string de formato a cada chamada), e 'parse_date' roda para cada linha da
+# sincronização.
+_DMY_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+_SHEETS_DATE_RE = re.compile(r'^Date\((\d+),(\d+),(\d+)\)$')
+
+# "Época" do sistema de datas do Google Sheets: o número serial 1 corresponde a
+# 31/12/1899 (data-base 30/12/1899). Com 'UNFORMATTED_VALUE', as células de
+# data chegam como número de dias desde essa base.
+_SHEETS_EPOCH = date(1899, 12, 30)
+
 def parse_date(value):
     """
-    Função auxiliar para converter strings de data em diferentes formatos
-    para um objeto de data do Python.
+    Função auxiliar para converter datas da planilha — número serial do Sheets
+    ou string em diferentes formatos — para um objeto de data do Python.
     """
     if value is None:
         return None
-    
+
+    # Número serial do Sheets (dias desde 30/12/1899), formato retornado
+    # quando os valores são lidos com 'UNFORMATTED_VALUE'.
+    if isinstance(value, (int, float)):
+        try:
+            return _SHEETS_EPOCH + timedelta(days=int(value))
+        except OverflowError:
+            return None
+
+    value = value.strip()
+
     # Tenta converter o formato "dd/mm/yyyy".
-    try:
-        return datetime.strptime(value, "%d/%m/%Y").date()
-    except ValueError:
-        pass # Se falhar, tenta o próximo formato.
+    match = _DMY_RE.match(value)
+    if match:
+        try:
+            return date(int(match[3]), int(match[2]), int(match[1]))
+        except ValueError:
+            return None # Números fora do intervalo válido (ex: mês 13).
 
     # Tenta converter o formato "Date(YYYY,MM,DD)" que algumas planilhas geram.
-    try:
-        if value.startswith("Date(") and value.endswith(")"):
-            parts = value[5:-1].split(",")
-            year, month, day = map(int, parts)
-            return datetime(year, month, day).date()
-    except Exception:
-        pass
-    
+    match = _SHEETS_DATE_RE.match(value)
+    if match:
+        try:
+            return date(int(match[1]), int(match[2]), int(match[3]))
+        except ValueError:
+            return None
+
     # Se nenhum formato for reconhecido, retorna None.
     return None
 
@@ -245,8 +589,17 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    # Compara o usuário e senha recebidos com os valores definidos nas variáveis de ambiente.
-    if username == APP_USERNAME and password == APP_PASSWORD:
+    # Compara o usuário e senha recebidos com os valores definidos nas variáveis
+    # de ambiente em tempo constante ('compare_digest'), e sem curto-circuito
+    # entre os dois campos ('&'), para não vazar pelo tempo de resposta qual
+    # parte da credencial está errada. A comparação é feita sobre bytes:
+    # 'compare_digest' levanta TypeError para strings com caracteres
+    # não-ASCII (ex: nomes ou senhas com acento).
+    username_ok = hmac.compare_digest(
+        (username or '').encode(), (APP_USERNAME or '').encode())
+    password_ok = hmac.compare_digest(
+        (password or '').encode(), (APP_PASSWORD or '').encode())
+    if username_ok & password_ok:
         session['logged_in'] = True # Se correto, marca a sessão como 'logada'.
         return jsonify({'success': True}) # Retorna sucesso em JSON para o JavaScript.
     else:
@@ -257,93 +610,206 @@ def login():
 def check_session():
     """
     Uma rota auxiliar para o front-end verificar se o usuário já está logado
-    (útil ao recarregar a página).
+    (útil ao recarregar a página). Como a resposta é só um booleano, ela ganha
+    um ETag e um 'Cache-Control' curto: em navegações seguidas o navegador
+    recebe um '304 Not Modified' vazio em vez do JSON completo.
     """
-    return jsonify({'logged_in': session.get('logged_in', False)})
+    logged_in = session.get('logged_in', False)
+    response = jsonify({'logged_in': logged_in})
+    response.headers['Cache-Control'] = 'private, max-age=5'
+    response.set_etag(f'session-{logged_in}', weak=True)
+    # 'make_conditional' devolve 304 sem corpo se o If-None-Match do navegador
+    # bater com o ETag atual.
+    return response.make_conditional(request)
 
 # ---------------------------------------------------------------------------
 # ROTAS PRINCIPAIS DA APLICAÇÃO
 # ---------------------------------------------------------------------------
 
+@cached_query(ttl=60)
+def get_patients_state():
+    """
+    Resume o estado dos dados exibidos na listagem em uma tupla barata:
+    contagem e maior id dos pacientes, mais a contagem de cada tabela de etapa
+    (os botões da listagem dependem das etapas concluídas). Uma única consulta
+    de agregados, memoizada por 'cached_query' — refreshes repetidos do painel
+    nem tocam o banco até que algo seja escrito ou o TTL expire.
+    """
+    return tuple(db.session.execute(select(
+        func.count(FormResponse.id),
+        func.coalesce(func.max(FormResponse.id), 0),
+        select(func.count(CaseEvaluation.id)).scalar_subquery(),
+        select(func.count(Authorization.id)).scalar_subquery(),
+        select(func.count(ProcedureExecution.id)).scalar_subquery(),
+        select(func.count(FollowUp.id)).scalar_subquery(),
+    )).one())
+
 @app.route('/listpatient')
 @login_required # Protege esta rota: só pode ser acessada por usuários logados.
 def list_patients():
     """
-    Exibe a lista de pacientes. Primeiro, sincroniza com a planilha do Google
-    para buscar novos pacientes.
+    Exibe a lista de pacientes a partir do banco de dados. A sincronização com
+    a planilha do Google só acontece se a última foi há mais de
+    SYNC_INTERVAL_SECONDS — nos demais acessos a página é um leitura pura do banco.
     """
-    # Chama a função para buscar e adicionar novos pacientes da planilha.
-    new_entries = fetch_responses()
-    print(f"{new_entries} novo(s) paciente(s) adicionado(s) antes de exibir a lista.")
+    # Sincroniza com a planilha apenas se a última sincronização estiver "velha".
+    new_entries = sync_responses_if_stale()
+    if new_entries:
+        print(f"{new_entries} novo(s) paciente(s) adicionado(s) antes de exibir a lista.")
+
+    # Obtém o resumo do estado dos dados (com cache) e monta o ETag. Se o
+    # navegador já tem essa versão da página, respondemos '304 Not Modified'
+    # sem consultar os pacientes nem renderizar o template.
+    state = get_patients_state()
+    etag = 'patients-' + '-'.join(str(value) for value in state)
+    if request.if_none_match.contains_weak(etag):
+        return '', 304
 
     # Pega o termo de busca da URL (ex: /listpatient?search=Maria).
     search_query = request.args.get('search', '')
+    # 'after_id': paginação por "keyset" — mostra os pacientes com id menor que
+    # o último id da página anterior. Diferente de OFFSET, o custo não cresce
+    # com a profundidade da página.
+    after_id = request.args.get('after_id', type=int)
+
+    # Carrega apenas as colunas que a listagem realmente exibe, ordena do mais
+    # recente para o mais antigo e limita ao tamanho da página. Busca uma linha
+    # a mais só para saber se existe uma próxima página.
+    # O 'undefer' liga as flags 'has_*' (subselects EXISTS) nesta consulta: os
+    # botões de etapa do template usam só esses booleanos, sem carregar as
+    # linhas das tabelas filhas.
+    # A consulta é a mais executada da aplicação, por isso vai dentro de
+    # 'lambda_stmt': cada combinação de filtros (com/sem busca, com/sem
+    # paginação) é compilada uma única vez e depois reaproveitada, trocando
+    # apenas os parâmetros.
+    stmt = lambda_stmt(lambda: (
+        select(FormResponse)
+        .options(
+            load_only(
+                FormResponse.id,
+                FormResponse.patient_full_name,
+                FormResponse.referral_date,
+                FormResponse.patient_contact,
+            ),
+            undefer(FormResponse.has_case_evaluation),
+            undefer(FormResponse.has_authorization),
+            undefer(FormResponse.has_procedure_execution),
+            undefer(FormResponse.has_follow_up),
+        )
+        .order_by(FormResponse.id.desc())
+        .limit(PAGE_SIZE + 1)
+    ))
     if search_query:
-        # Se houver busca, filtra os pacientes cujo nome contenha o termo buscado (ignorando maiúsculas/minúsculas).
-        patients = FormResponse.query.filter(FormResponse.patient_full_name.ilike(f"%{search_query}%")).all()
-    else:
-        # Se não houver busca, pega todos os pacientes.
-        patients = FormResponse.query.all()
-
-    # Renderiza o template 'listpatient.html', passando a lista de pacientes e o termo de busca.
-    return render_template('listpatient.html', patients=patients, search_query=search_query)
+        # Se houver busca, filtra os pacientes cujo nome contenha o termo
+        # buscado (ignorando maiúsculas/minúsculas).
+        search_pattern = f"%{search_query}%"
+        stmt += lambda s: s.where(
+            FormResponse.patient_full_name.ilike(search_pattern))
+    if after_id is not None:
+        stmt += lambda s: s.where(FormResponse.id < after_id)
+    if STRICT_LAZY_LOADS:
+        # A listagem só usa as flags 'has_*'; se algum código novo tocar um
+        # relacionamento destes objetos, é melhor falhar alto do que disparar
+        # um SELECT por linha sem ninguém perceber.
+        stmt += lambda s: s.options(raiseload('*'))
+
+    patients = db.session.execute(stmt).scalars().all()
+    has_next = len(patients) > PAGE_SIZE
+    patients = patients[:PAGE_SIZE]
+    next_after_id = patients[-1].id if has_next else None
+
+    # Renderiza o template 'listpatient.html', passando a lista de pacientes e o
+    # termo de busca, e anexa o ETag calculado acima para as próximas visitas.
+    response = make_response(render_template(
+        'listpatient.html', patients=patients,
+        search_query=search_query, next_after_id=next_after_id))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag, weak=True)
+    return response
+
+@app.route('/sync', methods=['POST'])
+@login_required
+def sync():
+    """
+    Força uma sincronização imediata com a planilha do Google, ignorando o
+    intervalo mínimo. Útil quando o usuário sabe que acabou de chegar uma
+    resposta nova no formulário.
+    """
+    global _last_sync_time
+    with _sync_lock:
+        new_entries = fetch_responses()
+        _last_sync_time = time.monotonic()
+    return jsonify({'new_entries': new_entries})
 
-def remove_patient_from_google_sheets(full_name):
+def remove_patients_from_google_sheets(full_names):
     """
-    Remove a linha correspondente a um paciente da planilha do Google.
+    Remove da planilha do Google as linhas correspondentes a uma lista de pacientes.
+    A planilha é lida UMA única vez e todas as exclusões são enviadas em um único
+    'batchUpdate' — duas chamadas à API no total, independentemente de quantos
+    pacientes forem removidos.
     """
     try:
         service = get_google_sheet_service()
         sheet = service.spreadsheets()
-        
+
         # Obtém o ID numérico da aba, necessário para a exclusão.
         sheet_id = get_sheet_id()
         if sheet_id is None:
             print("Erro: ID da planilha não encontrado.")
             return False
 
-        # Pega todos os valores da planilha para encontrar a linha a ser deletada.
-        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range=RANGE_NAME).execute()
-        values = result.get('values', [])
+        # Pega todos os valores da planilha para encontrar as linhas a serem deletadas.
+        values = get_sheet_values()
 
         if not values:
             print("A planilha estava vazia ou ocorreu um erro ao buscar os dados.")
             return False
 
-        # Encontra o índice da linha onde o nome do paciente corresponde.
-        row_to_delete = None
+        # Normaliza os nomes procurados para comparação (sem espaços extras,
+        # ignorando maiúsculas/minúsculas).
+        wanted_names = {name.strip().lower() for name in full_names}
+
+        # Encontra os índices de todas as linhas cujos nomes correspondem.
+        rows_to_delete = []
         for i, row in enumerate(values):
-            # Compara o nome na coluna 2 (índice), ignorando espaços extras e maiúsculas/minúsculas.
-            if len(row) > 2 and row[2].strip().lower() == full_name.strip().lower():
-                row_to_delete = i # Armazena o índice da linha.
-                break
-
-        # Se a linha foi encontrada, monta e executa o pedido de exclusão.
-        if row_to_delete is not None:
-            batch_update_request = {
-                "requests": [{
-                    "deleteDimension": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "dimension": "ROWS", # Queremos deletar uma linha.
-                            "startIndex": row_to_delete, # Índice inicial da linha.
-                            "endIndex": row_to_delete + 1 # Índice final (exclusivo).
-                        }
-                    }
-                }]
-            }
-            # Envia a requisição para a API para deletar a linha.
-            sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=batch_update_request).execute()
-            print(f"Paciente com nome {full_name} foi removido da planilha Google Sheets.")
-            return True
-        else:
-            print(f"Paciente com nome {full_name} não foi encontrado na planilha.")
+            if len(row) > 2 and row[2].strip().lower() in wanted_names:
+                rows_to_delete.append(i)
+
+        if not rows_to_delete:
+            print(f"Nenhum dos pacientes {full_names} foi encontrado na planilha.")
             return False
 
+        # Monta um único pedido com todas as exclusões, em ordem DECRESCENTE de
+        # índice: deletar de baixo para cima garante que uma exclusão não
+        # desloque os índices das linhas que ainda serão deletadas.
+        batch_update_request = {
+            "requests": [{
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": sheet_id,
+                        "dimension": "ROWS", # Queremos deletar linhas.
+                        "startIndex": row_index, # Índice inicial da linha.
+                        "endIndex": row_index + 1 # Índice final (exclusivo).
+                    }
+                }
+            } for row_index in sorted(rows_to_delete, reverse=True)]
+        }
+        # Envia a requisição para a API para deletar todas as linhas de uma vez.
+        sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=batch_update_request).execute()
+        print(f"{len(rows_to_delete)} paciente(s) removido(s) da planilha Google Sheets.")
+        return True
+
     except Exception as e:
         print(f"Ocorreu um erro ao tentar remover do Google Sheets: {e}")
         return False
 
+def remove_patient_from_google_sheets(full_name):
+    """
+    Remove a linha correspondente a um único paciente da planilha do Google.
+    Conveniência sobre a versão em lote acima.
+    """
+    return remove_patients_from_google_sheets([full_name])
+
 @app.route('/delete_patient/<int:patient_id>', methods=['POST'])
 @login_required
 def delete_patient(patient_id):
@@ -351,21 +817,80 @@ def delete_patient(patient_id):
     Deleta um paciente tanto do banco de dados local quanto da planilha do Google.
     """
     # Encontra o paciente no banco de dados. Se não achar, retorna erro 404.
-    patient = FormResponse.query.get_or_404(patient_id)
-    
+    # 'db.get_or_404' usa 'Session.get', que consulta primeiro o identity map
+    # da sessão antes de ir ao banco. 'load_only' busca só as colunas usadas
+    # pela rota (id e nome), em vez das 11 colunas da tabela.
+    patient = db.get_or_404(FormResponse, patient_id, options=[
+        load_only(FormResponse.id, FormResponse.patient_full_name)])
+
     if patient:
         full_name = patient.patient_full_name
-        # Deleta o paciente do banco de dados local.
+        # Prepara a exclusão no banco ('flush' envia o DELETE sem confirmar)...
         db.session.delete(patient)
-        db.session.commit()
-        print(f"Paciente {full_name} foi removido do banco de dados.")
+        db.session.flush()
 
-        # Chama a função para remover também da planilha do Google.
+        # ...remove também da planilha do Google...
         remove_patient_from_google_sheets(full_name)
 
+        # ...e só então confirma a transação — um único commit (e um único
+        # fsync no banco) por requisição, depois que as duas remoções foram
+        # tentadas.
+        db.session.commit()
+        print(f"Paciente {full_name} foi removido do banco de dados.")
+
     # Redireciona de volta para a lista de pacientes.
     return redirect(url_for('list_patients'))
 
+@app.route('/delete_patients', methods=['POST'])
+@login_required
+def delete_patients():
+    """
+    Deleta vários pacientes de uma só vez, do banco de dados local e da planilha
+    do Google. Recebe os IDs via formulário (campo repetido 'patient_ids') e faz
+    a limpeza da planilha em lote — uma leitura e um 'batchUpdate', em vez de
+    duas chamadas à API por paciente.
+    """
+    patient_ids = request.form.getlist('patient_ids', type=int)
+    if not patient_ids:
+        flash("Nenhum paciente selecionado para exclusão.", "warning")
+        return redirect(url_for('list_patients'))
+
+    # Busca todos os pacientes selecionados em uma única consulta.
+    patients = FormResponse.query.filter(FormResponse.id.in_(patient_ids)).all()
+    full_names = [patient.patient_full_name for patient in patients]
+
+    # Prepara a exclusão de todos no banco de dados ('flush' envia os DELETEs
+    # sem confirmar a transação ainda).
+    for patient in patients:
+        db.session.delete(patient)
+    db.session.flush()
+
+    # Remove todos da planilha do Google em lote.
+    if full_names:
+        remove_patients_from_google_sheets(full_names)
+
+    # Um único commit (um único fsync) para o lote inteiro, após a limpeza da
+    # planilha — N commits viram 1.
+    db.session.commit()
+    print(f"{len(patients)} paciente(s) removido(s) do banco de dados.")
+
+    return redirect(url_for('list_patients'))
+
+def stage_already_done(model, patient_id):
+    """
+    Verifica se o paciente já tem um registro da etapa 'model' (ex: uma
+    avaliação de caso). Usa 'SELECT EXISTS' em vez de buscar a linha com
+    '.first()': o banco responde com um booleano a partir de um plano mais
+    barato, sem transferir colunas nem materializar um objeto do ORM. O
+    'lambda_stmt' reaproveita o SQL já compilado entre requisições: só o
+    'patient_id' muda de uma execução para a outra (o 'model' entra na chave
+    do cache, então cada etapa tem a sua versão compilada).
+    """
+    stmt = lambda_stmt(
+        lambda: select(exists().where(model.patient_id == patient_id))
+    )
+    return db.session.execute(stmt).scalar()
+
 # ---------------------------------------------------------------------------
 # ROTAS DOS FORMULÁRIOS DE ETAPAS DO PROCESSO
 # ---------------------------------------------------------------------------
@@ -379,15 +904,25 @@ def delete_patient(patient_id):
 @login_required
 def case_evaluation(patient_id):
     """Rota para o formulário de Avaliação do Caso."""
-    patient = FormResponse.query.get_or_404(patient_id)
+    # Carrega só o que a rota usa (id e nome) via 'Session.get' + 'load_only'.
+    patient = db.get_or_404(FormResponse, patient_id, options=[
+        load_only(FormResponse.id, FormResponse.patient_full_name)])
 
     if request.method == 'POST':
+        # Evita registros duplicados caso o formulário seja reenviado.
+        if stage_already_done(CaseEvaluation, patient.id):
+            flash("Este paciente já possui uma avaliação de caso.", "warning")
+            return redirect(url_for('list_patients'))
+
         # Coleta os dados do formulário enviado.
         evaluation_date = datetime.strptime(request.form['evaluation_date'], '%Y-%m-%d').date()
         diagnosis_2 = request.form['diagnosis_2']
         severity = request.form['severity']
         procedure_requested = request.form['procedure_requested']
+        # Resolve o nome do solicitante no id da tabela de consulta (criando a
+        # entrada na primeira vez que o nome aparece).
         requester = request.form['requester']
+        requester_id = Requester.ids_for({requester}).get(requester)
         opme_needed = request.form.get('opme_needed') == 'True'
         special_opme = request.form.get('special_opme') == 'True'
         previous_complications = request.form.get('previous_complications') == 'True'
@@ -399,7 +934,7 @@ def case_evaluation(patient_id):
             diagnosis_2=diagnosis_2,
             severity=severity,
             procedure_requested=procedure_requested,
-            requester=requester,
+            requester_id=requester_id,
             opme_needed=opme_needed,
             special_opme=special_opme,
             previous_complications=previous_complications
@@ -418,9 +953,15 @@ def case_evaluation(patient_id):
 @login_required
 def authorization(patient_id):
     """Rota para o formulário de Autorização."""
-    patient = FormResponse.query.get_or_404(patient_id)
+    patient = db.get_or_404(FormResponse, patient_id, options=[
+        load_only(FormResponse.id, FormResponse.patient_full_name)])
 
     if request.method == 'POST':
+        # Evita registros duplicados caso o formulário seja reenviado.
+        if stage_already_done(Authorization, patient.id):
+            flash("Este paciente já possui uma autorização.", "warning")
+            return redirect(url_for('list_patients'))
+
         # Converte o valor do checkbox 'on' para True/False.
         opme_authorization = request.form.get('opme_authorization') == 'on'
 
@@ -430,13 +971,19 @@ def authorization(patient_id):
         execution_time = datetime.strptime(request.form['execution_time'], '%H:%M').time() if request.form['execution_time'] else None
         cancellation_reason = request.form.get('cancellation_reason', '')
 
+        # Combina data e hora no timestamp único 'execution_at' (meia-noite se
+        # a hora não foi informada; nulo se a data também não foi).
+        execution_at = None
+        if execution_date is not None:
+            execution_at = datetime.combine(
+                execution_date, execution_time or datetime.min.time())
+
         # Cria a instância do modelo e salva no banco.
         auth = Authorization(
             patient_id=patient.id,
             opme_authorization=opme_authorization,
             scheduling_date=scheduling_date,
-            execution_date=execution_date,
-            execution_time=execution_time,
+            execution_at=execution_at,
             cancellation_reason=cancellation_reason
         )
         db.session.add(auth)
@@ -451,9 +998,15 @@ def authorization(patient_id):
 @login_required
 def procedure_execution(patient_id):
     """Rota para o formulário de Execução do Procedimento."""
-    patient = FormResponse.query.get_or_404(patient_id)
+    patient = db.get_or_404(FormResponse, patient_id, options=[
+        load_only(FormResponse.id, FormResponse.patient_full_name)])
 
     if request.method == 'POST':
+        # Evita registros duplicados caso o formulário seja reenviado.
+        if stage_already_done(ProcedureExecution, patient.id):
+            flash("Este paciente já possui uma execução de procedimento.", "warning")
+            return redirect(url_for('list_patients'))
+
         # Coleta e processa os dados do formulário.
         execution_date = datetime.strptime(request.form['execution_date'], '%Y-%m-%d').date()
         medical_report = request.form['medical_report']
@@ -480,9 +1033,15 @@ def procedure_execution(patient_id):
 @login_required
 def follow_up(patient_id):
     """Rota para o formulário de Acompanhamento Pós-Procedimento."""
-    patient = FormResponse.query.get_or_404(patient_id)
+    patient = db.get_or_404(FormResponse, patient_id, options=[
+        load_only(FormResponse.id, FormResponse.patient_full_name)])
 
     if request.method == 'POST':
+        # Evita registros duplicados caso o formulário seja reenviado.
+        if stage_already_done(FollowUp, patient.id):
+            flash("Este paciente já possui um acompanhamento pós-procedimento.", "warning")
+            return redirect(url_for('list_patients'))
+
         # Coleta e processa os dados do formulário.
         post_procedure_complications = request.form.get('post_procedure_complications') == 'on'
         
@@ -505,33 +1064,87 @@ def patient_summary(patient_id):
     """
     Exibe uma página com o resumo completo de todas as informações de um paciente.
     """
-    # Busca o paciente principal.
-    patient = FormResponse.query.get_or_404(patient_id)
-
-    # Busca os dados de cada etapa do processo relacionados a este paciente.
-    # '.first()' é usado porque esperamos no máximo um registro por etapa para cada paciente.
-    case_evaluation = CaseEvaluation.query.filter_by(patient_id=patient_id).first()
-    authorization = Authorization.query.filter_by(patient_id=patient_id).first()
-    procedure_execution = ProcedureExecution.query.filter_by(patient_id=patient_id).first()
-    follow_up = FollowUp.query.filter_by(patient_id=patient_id).first()
-
-    # Renderiza a página de resumo, passando todos os objetos de dados encontrados.
-    return render_template(
-        'patient_summary.html',
-        patient=patient,
-        case_evaluation=case_evaluation,
-        authorization=authorization,
-        procedure_execution=procedure_execution,
-        follow_up=follow_up
+    # Busca o paciente e todas as etapas do processo em UMA única consulta:
+    # os 'joinedload' trazem as quatro tabelas filhas no mesmo SELECT (LEFT
+    # OUTER JOIN), em vez de uma consulta separada por etapa. O template acessa
+    # tudo através dos relacionamentos ('patient.case_evaluation', etc.).
+    # Os 'undefer_group' reativam aqui as colunas de texto clínico (adiadas por
+    # padrão para aliviar as listagens), já que o resumo exibe esses textos.
+    options = [
+        undefer_group('clinical_text'),
+        # As tabelas de consulta (localização e solicitante) entram no mesmo
+        # SELECT: joins por chave primária em tabelas minúsculas.
+        joinedload(FormResponse.location_ref),
+        joinedload(FormResponse.case_evaluation)
+            .joinedload(CaseEvaluation.requester_ref),
+        joinedload(FormResponse.case_evaluation).undefer_group('clinical_text'),
+        joinedload(FormResponse.authorization).undefer_group('clinical_text'),
+        joinedload(FormResponse.procedure_execution).undefer_group('clinical_text'),
+        joinedload(FormResponse.follow_up),
+    ]
+    if STRICT_LAZY_LOADS:
+        # Tudo que o resumo precisa está carregado pelos 'joinedload' acima;
+        # qualquer outro relacionamento acessado por engano deve falhar alto.
+        options.append(raiseload('*'))
+    patient = (
+        FormResponse.query
+        .options(*options)
+        .filter_by(id=patient_id)
+        .first_or_404()
     )
 
+    # Renderiza a página de resumo, passando o paciente com tudo já carregado.
+    return render_template('patient_summary.html', patient=patient)
+
+# ---------------------------------------------------------------------------
+# COMANDOS DE MANUTENÇÃO (Flask CLI)
+# ---------------------------------------------------------------------------
+
+@app.cli.command('cluster-patients')
+def cluster_patients():
+    """
+    Reordena fisicamente a tabela 'form_response' pela data de encaminhamento
+    ('CLUSTER ... USING ix_form_response_referral_date'). Consultas por janela
+    de datas ("últimos 30 dias") passam a ler páginas contíguas do disco — I/O
+    sequencial — em vez de pular pela tabela na ordem de inserção. O CLUSTER
+    não é mantido automaticamente; agende este comando (ex: cron semanal, fora
+    do horário de pico, pois ele trava a tabela enquanto reescreve):
+
+        flask cluster-patients
+
+    Só tem efeito no PostgreSQL; em outros bancos (ex: SQLite em
+    desenvolvimento) o comando apenas avisa e sai.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        print("CLUSTER só está disponível no PostgreSQL; nada a fazer.")
+        return
+    with db.engine.connect() as connection:
+        # AUTOCOMMIT: CLUSTER e ANALYZE não podem rodar dentro de uma
+        # transação aberta pelo SQLAlchemy.
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        connection.exec_driver_sql(
+            'CLUSTER form_response USING ix_form_response_referral_date')
+        # Atualiza as estatísticas (inclusive a correlação física, que é o que
+        # faz o planejador preferir varreduras de índice após o CLUSTER).
+        connection.exec_driver_sql('ANALYZE form_response')
+    print("Tabela 'form_response' reordenada por referral_date.")
+
 # ---------------------------------------------------------------------------
 # INICIALIZAÇÃO DA APLICAÇÃO
 # ---------------------------------------------------------------------------
 
-# Este bloco só é executado quando o script 'app.py' é rodado diretamente.
+# Este bloco só é executado quando o script 'app.py' é rodado diretamente —
+# ou seja, apenas em DESENVOLVIMENTO. O servidor embutido do Werkzeug atende
+# uma requisição por vez, então em produção cada '/listpatient' bloquearia
+# todas as outras requisições. Em produção, rode a aplicação com um servidor
+# WSGI de verdade, por exemplo:
+#
+#     gunicorn -k gevent -w 4 --worker-connections 100 app:app
+#
+# Os workers gevent liberam o loop durante o I/O de rede (chamadas à API do
+# Google, banco de dados), permitindo requisições concorrentes.
 if __name__ == '__main__':
-    # Inicia o servidor de desenvolvimento do Flask.
-    # 'debug=True' ativa o modo de depuração, que reinicia o servidor automaticamente
-    # a cada mudança no código e mostra erros detalhados no navegador.
-    app.run(debug=True)
+    # Inicia o servidor de desenvolvimento do Flask. O modo de depuração
+    # (recarga automática + erros detalhados no navegador) só é ativado se a
+    # variável de ambiente FLASK_DEBUG estiver ligada — nunca por padrão.
+    app.run(debug=os.getenv('FLASK_DEBUG', '0') == '1')
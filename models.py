@@ -4,10 +4,87 @@
 # para interagir com o banco de dados.
 from flask_sqlalchemy import SQLAlchemy
 
+# 'event' e 'DDL' são usados para executar comandos específicos do PostgreSQL
+# (como criar a extensão de trigramas) na hora de criar as tabelas.
+from sqlalchemy import event, DDL, select, exists, case
+
+# 'column_property' e 'deferred' permitem expor expressões SQL calculadas pelo
+# banco como atributos dos modelos ou adiar a carga de colunas pesadas até que
+# sejam realmente acessadas.
+from sqlalchemy.orm import column_property, deferred
+
+# 'hybrid_property' cria atributos que funcionam tanto em instâncias Python
+# quanto em expressões SQL (usado para as flags booleanas empacotadas).
+from sqlalchemy.ext.hybrid import hybrid_property
+
 # Cria uma instância do SQLAlchemy. Esta instância 'db' será usada em toda a aplicação
 # para definir modelos (tabelas) e executar consultas no banco de dados.
 db = SQLAlchemy()
 
+# No PostgreSQL, garante que a extensão 'pg_trgm' (busca por trigramas) exista
+# antes de criar as tabelas. Ela é necessária para o índice GIN que acelera a
+# busca de pacientes por trecho do nome (ILIKE '%...%'). Em outros bancos
+# (ex: SQLite), este comando simplesmente não é executado.
+event.listen(
+    db.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+# ---------------------------------------------------------------------------
+# TABELAS DE CONSULTA (lookup): Location e Requester
+# DESCRIÇÃO: Os campos de localização e solicitante são texto livre na
+# planilha, mas na prática vêm de um conjunto pequeno de alas e médicos.
+# Guardar o texto uma única vez aqui e referenciá-lo por um inteiro de 4 bytes
+# deixa as linhas de 'form_response' e 'case_evaluation' bem mais estreitas
+# (mais tuplas por página, varreduras mais rápidas) e transforma agrupamentos
+# por localização em varreduras de índice sobre inteiros.
+# ---------------------------------------------------------------------------
+
+class _NameLookupMixin:
+    """Comportamento comum das tabelas de consulta: resolver nomes em ids."""
+
+    @classmethod
+    def ids_for(cls, names):
+        """
+        Resolve um conjunto de nomes em um dicionário {nome: id}, criando as
+        entradas que ainda não existem. Custa no máximo duas consultas (um
+        SELECT pelos existentes e um INSERT em lote dos faltantes) para
+        qualquer quantidade de nomes — nunca uma consulta por nome. Usa
+        'flush' em vez de 'commit': a criação participa da transação de quem
+        chamou.
+        """
+        names = {name for name in names if name is not None}
+        if not names:
+            return {}
+        mapping = dict(
+            db.session.execute(
+                select(cls.name, cls.id).where(cls.name.in_(names))
+            ).all()
+        )
+        missing = names - mapping.keys()
+        if missing:
+            db.session.execute(
+                db.insert(cls), [{'name': name} for name in sorted(missing)])
+            db.session.flush()
+            mapping.update(
+                db.session.execute(
+                    select(cls.name, cls.id).where(cls.name.in_(missing))
+                ).all()
+            )
+        return mapping
+
+class Location(db.Model, _NameLookupMixin):
+    # Localizações (alas/unidades) de onde os pacientes são encaminhados.
+    id = db.Column(db.Integer, primary_key=True)
+    # 'unique=True' garante uma linha por localização e cria o índice usado
+    # pelo 'ids_for' para resolver nomes em ids.
+    name = db.Column(db.String(120), unique=True, nullable=False)
+
+class Requester(db.Model, _NameLookupMixin):
+    # Médicos/solicitantes que pedem as avaliações de caso.
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+
 # ---------------------------------------------------------------------------
 # MODELO: FormResponse
 # DESCRIÇÃO: Representa a tabela principal que armazena os dados iniciais do paciente,
@@ -16,11 +93,40 @@ db = SQLAlchemy()
 class FormResponse(db.Model):
     # Define as colunas da tabela 'form_response' no banco de dados.
 
+    # Restrição de unicidade no nome do paciente: garante, no nível do banco,
+    # que não existam dois registros para o mesmo paciente. Com ela, a
+    # deduplicação da sincronização pode ser delegada ao banco (via
+    # "ON CONFLICT DO NOTHING" no PostgreSQL), o que é seguro mesmo com
+    # sincronizações concorrentes. O índice único também acelera buscas por nome.
+    __table_args__ = (
+        db.UniqueConstraint('patient_full_name', name='uq_patient_full_name'),
+        # Índice GIN de trigramas (só tem efeito no PostgreSQL): permite que a
+        # busca por trecho do nome (ILIKE '%termo%') use o índice em vez de
+        # varrer a tabela inteira. Um B-tree comum não serve para curingas no
+        # início do padrão. Nos demais dialetos os parâmetros 'postgresql_*'
+        # são ignorados.
+        db.Index(
+            'idx_patient_name_trgm', 'patient_full_name',
+            postgresql_using='gin',
+            postgresql_ops={'patient_full_name': 'gin_trgm_ops'},
+        ),
+        # Índice para painéis ordenados por data de encaminhamento: o ORDER BY
+        # é servido pelo índice, sem etapa de ordenação (árvores B atendem
+        # ASC e DESC nas duas direções de varredura).
+        db.Index('ix_form_response_referral_date', 'referral_date'),
+        # Índice composto para consultas filtradas por tipo de internação e
+        # janela de datas ("urgências dos últimos 30 dias"): o filtro e a
+        # ordenação usam o mesmo índice, em custo logarítmico.
+        db.Index('ix_form_response_type_date', 'internment_type', 'referral_date'),
+    )
+
     # 'id': Chave primária. Um número inteiro único que identifica cada registro.
     id = db.Column(db.Integer, primary_key=True)
     
-    # 'patient_full_name': Nome completo do paciente. String com até 200 caracteres, não pode ser nulo.
-    patient_full_name = db.Column(db.String(200), nullable=False)
+    # 'patient_full_name': Nome completo do paciente. 120 caracteres dão folga
+    # para nomes compostos longos; um limite realista (em vez do 200 genérico)
+    # produz índices de nome mais compactos, com melhor localidade de cache.
+    patient_full_name = db.Column(db.String(120), nullable=False)
     
     # 'patient_age': Idade do paciente. Número inteiro, não pode ser nulo.
     patient_age = db.Column(db.Integer, nullable=False)
@@ -34,75 +140,250 @@ class FormResponse(db.Model):
     # 'internment_type': Tipo de internação. String com até 50 caracteres, não pode ser nulo.
     internment_type = db.Column(db.String(50), nullable=False)
     
-    # 'location': Localização do paciente. String com até 200 caracteres, não pode ser nulo.
-    location = db.Column(db.String(200), nullable=False)
+    # 'location_id': Localização do paciente, normalizada na tabela 'location'.
+    # Um inteiro de 4 bytes no lugar de até 200 bytes de texto repetido por
+    # linha; o texto em si fica uma única vez na tabela de consulta.
+    location_id = db.Column(db.Integer, db.ForeignKey('location.id'), nullable=False, index=True)
+
+    # Relacionamento com a tabela de consulta. 'joined' porque a tabela é
+    # minúscula e o join por chave primária é praticamente gratuito.
+    location_ref = db.relationship('Location', lazy='joined')
+
+    @property
+    def location(self):
+        """
+        Compatibilidade: o restante da aplicação (templates, resumo) continua
+        lendo 'patient.location' como texto, agora resolvido via a tabela de
+        consulta.
+        """
+        return self.location_ref.name if self.location_ref is not None else None
     
-    # 'procedure': Procedimento inicial. String com até 200 caracteres, não pode ser nulo.
-    procedure = db.Column(db.String(200), nullable=False)
+    # 'procedure': Procedimento inicial. String com até 120 caracteres, não pode ser nulo.
+    procedure = db.Column(db.String(120), nullable=False)
     
     # 'diagnosis': Diagnóstico inicial. Campo de texto longo, não pode ser nulo.
-    diagnosis = db.Column(db.Text, nullable=False)
-    
-    # 'condition_severity': Gravidade da condição. String com até 200 caracteres, não pode ser nulo.
-    condition_severity = db.Column(db.String(200), nullable=False)
+    # 'deferred': o texto pode ser grande e as listagens não o exibem; adiar a
+    # carga tira esses bytes das consultas de lista. As colunas do grupo
+    # 'clinical_text' são carregadas juntas quando alguma delas é acessada
+    # (ex: no resumo do paciente).
+    diagnosis = deferred(db.Column(db.Text, nullable=False), group='clinical_text')
     
+    # 'condition_severity': Gravidade da condição. O formulário oferece um
+    # conjunto pequeno de opções curtas; 32 caracteres bastam.
+    condition_severity = db.Column(db.String(32), nullable=False)
+
     # 'email': E-mail de quem preencheu o formulário. Pode ser nulo.
-    email = db.Column(db.String(200), nullable=True)
+    # 254 é o comprimento máximo de um endereço de e-mail (RFC 5321).
+    email = db.Column(db.String(254), nullable=True)
+
+    # 'workflow_stage': etapa mais avançada já concluída por este paciente
+    # (0 = nenhuma, 1 = avaliação, 2 = autorização, 3 = procedimento,
+    # 4 = acompanhamento). Mantida automaticamente pelos listeners no fim deste
+    # arquivo a cada inserção/remoção nas tabelas de etapa. Painéis podem
+    # filtrar e ordenar por esta única coluna indexada, sem nenhum JOIN ou
+    # subselect EXISTS. 'server_default' garante o valor 0 também nos caminhos
+    # de inserção em massa (COPY / INSERT direto) que não passam pelo ORM.
+    workflow_stage = db.Column(db.SmallInteger, nullable=False, default=0,
+                               server_default='0', index=True)
 
     # --- RELACIONAMENTOS ---
     # Define as ligações entre esta tabela (FormResponse) e as outras tabelas do sistema.
     # Estes relacionamentos permitem acessar os dados das tabelas filhas diretamente a partir de um objeto paciente.
 
     # 'case_evaluation': Relacionamento um-para-um com a tabela CaseEvaluation.
-    # 'backref='patient'': Permite que um objeto CaseEvaluation acesse o FormResponse pai através do atributo '.patient'.
+    # 'back_populates='patient'': liga explicitamente este lado ao atributo
+    #   '.patient' declarado em cada modelo filho. Diferente do 'backref'
+    #   implícito, o 'back_populates' permite configurar uma estratégia de
+    #   carga própria para cada direção (aqui: pai→filho 'joined', filho→pai
+    #   'raise_on_sql').
     # 'uselist=False': Especifica que este é um relacionamento um-para-um (cada paciente tem no máximo uma avaliação).
     # 'cascade="all, delete-orphan"': Regra importante! Se um paciente (FormResponse) for deletado,
     #                                  sua avaliação de caso associada também será deletada automaticamente.
-    case_evaluation = db.relationship('CaseEvaluation', backref='patient', uselist=False, cascade="all, delete-orphan")
-    authorization = db.relationship('Authorization', backref='patient', uselist=False, cascade="all, delete-orphan")
-    procedure_execution = db.relationship('ProcedureExecution', backref='patient', uselist=False, cascade="all, delete-orphan")
-    follow_up = db.relationship('FollowUp', backref='patient', uselist=False, cascade="all, delete-orphan")
+    # 'lazy='joined'': as quatro etapas são acessadas incondicionalmente pelos
+    # helpers 'is_*_done' na listagem de pacientes; com o lazy padrão, listar N
+    # pacientes dispararia 4N consultas extras (o clássico problema "N+1").
+    # Com 'joined', as filhas vêm no mesmo SELECT via LEFT OUTER JOIN — e como
+    # os relacionamentos são um-para-um, o join não multiplica linhas.
+    case_evaluation = db.relationship('CaseEvaluation', back_populates='patient', uselist=False, cascade="all, delete-orphan", lazy='joined')
+    authorization = db.relationship('Authorization', back_populates='patient', uselist=False, cascade="all, delete-orphan", lazy='joined')
+    procedure_execution = db.relationship('ProcedureExecution', back_populates='patient', uselist=False, cascade="all, delete-orphan", lazy='joined')
+    follow_up = db.relationship('FollowUp', back_populates='patient', uselist=False, cascade="all, delete-orphan", lazy='joined')
 
     # --- MÉTODOS AUXILIARES ---
     # Funções úteis para verificar o status do fluxo de um paciente nos templates HTML.
 
+    @classmethod
+    def bulk_import(cls, rows):
+        """
+        Insere um lote de respostas (lista de dicionários) pelo caminho de
+        INSERT em massa do SQLAlchemy 2.0: um único 'execute' com todos os
+        parâmetros, sem construir objetos do ORM nem passar pelo unit-of-work —
+        uma ordem de grandeza menos overhead de Python que 'session.add' por
+        linha. O commit fica a cargo de quem chama.
+        """
+        if rows:
+            db.session.execute(db.insert(cls), rows)
+
+    @classmethod
+    def with_all_children(cls):
+        """
+        Consulta base para telas que listam MUITOS pacientes e precisam dos
+        objetos completos das quatro etapas (edição em massa, exportações).
+        Usa 'selectinload': uma consulta extra por relacionamento, com
+        "IN (lista de ids)", totalizando 1 + 4 consultas para qualquer
+        quantidade de pacientes — em vez de 4N com carga preguiçosa, e sem
+        inflar a largura das linhas como um join quádruplo faria.
+        """
+        from sqlalchemy.orm import selectinload
+        return cls.query.options(
+            selectinload(cls.case_evaluation),
+            selectinload(cls.authorization),
+            selectinload(cls.procedure_execution),
+            selectinload(cls.follow_up),
+        )
+
+    # Cada helper lê o atributo 'has_*' correspondente: um booleano calculado
+    # pelo banco com um subselect EXISTS (ver o final deste arquivo), em vez de
+    # carregar a linha inteira da tabela filha só para testar 'is not None'.
+
     def is_case_evaluation_done(self):
         """Verifica se já existe uma avaliação de caso para este paciente."""
-        return self.case_evaluation is not None
+        return bool(self.has_case_evaluation)
 
     def is_authorization_done(self):
         """Verifica se já existe uma autorização para este paciente."""
-        return self.authorization is not None
+        return bool(self.has_authorization)
 
     def is_procedure_execution_done(self):
         """Verifica se já existe um registro de execução de procedimento para este paciente."""
-        return self.procedure_execution is not None
+        return bool(self.has_procedure_execution)
 
     def is_follow_up_done(self):
         """Verifica se já existe um registro de acompanhamento para este paciente."""
-        return self.follow_up is not None
+        return bool(self.has_follow_up)
 
 # ---------------------------------------------------------------------------
 # MODELO: CaseEvaluation
 # DESCRIÇÃO: Armazena os dados do formulário "Avaliação de Caso".
 # ---------------------------------------------------------------------------
 class CaseEvaluation(db.Model):
+    # Restrições CHECK para as colunas de valores enumerados: os formulários só
+    # oferecem estas opções (botões de rádio em 'case_evaluation.html'), e a
+    # restrição garante isso também no nível do banco — dados fora do conjunto
+    # são rejeitados e o planejador trabalha com cardinalidade limitada e
+    # estatísticas mais precisas. Um CHECK foi preferido a um ENUM nativo
+    # porque adicionar uma opção nova fica sendo uma mudança de constraint,
+    # não uma migração de tipo.
+    __table_args__ = (
+        db.CheckConstraint(
+            "severity IN ('eletivo', 'semi-eletivo', 'urgencia-ambulatorial', "
+            "'urgencia-internado', 'emergencia')",
+            name='ck_case_evaluation_severity'),
+        db.CheckConstraint(
+            "procedure_requested IN ('Cateterismo diagnóstico', "
+            "'Cateterismo terapêutico', 'Outro')",
+            name='ck_case_evaluation_procedure_requested'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     
     # 'patient_id': Chave estrangeira. Liga este registro a um paciente específico na tabela 'form_response'.
     # 'db.ForeignKey('form_response.id')' cria a restrição no nível do banco de dados.
-    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False)
-    
+    # 'unique=True': cada paciente tem no máximo UMA avaliação — o
+    # 'uselist=False' do ORM já assume isso, e a restrição única garante o
+    # invariante também no banco (inclusive sob inserções concorrentes). O
+    # índice único que a acompanha serve às cargas de relacionamento,
+    # verificações 'is_*_done' e cascatas de exclusão como uma busca pontual
+    # que devolve no máximo uma linha, em vez de uma varredura de faixa.
+    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False, unique=True)
+
     evaluation_date = db.Column(db.Date, nullable=False)
-    diagnosis_2 = db.Column(db.Text, nullable=False)
-    severity = db.Column(db.String(20), nullable=False)
+    # Texto longo, fora das consultas de lista (ver 'diagnosis' em FormResponse).
+    diagnosis_2 = deferred(db.Column(db.Text, nullable=False), group='clinical_text')
+    # 32 caracteres: o maior valor permitido pela restrição CHECK acima
+    # ('urgencia-ambulatorial') tem 21 — a largura da coluna precisa comportar
+    # todos os valores que a própria restrição admite.
+    severity = db.Column(db.String(32), nullable=False)
     procedure_requested = db.Column(db.String(100), nullable=False)
-    requester = db.Column(db.String(200), nullable=True) # Pode ser nulo
+    # 'requester_id': Solicitante da avaliação, normalizado na tabela
+    # 'requester' (ver Location/Requester no topo do arquivo). Pode ser nulo.
+    requester_id = db.Column(db.Integer, db.ForeignKey('requester.id'), nullable=True, index=True)
+
+    # Relacionamento com a tabela de consulta (mesma lógica de 'location_ref').
+    requester_ref = db.relationship('Requester', lazy='joined')
+
+    @property
+    def requester(self):
+        """Compatibilidade: expõe o nome do solicitante como texto."""
+        return self.requester_ref.name if self.requester_ref is not None else None
     
-    # Campos booleanos (verdadeiro/falso) para checkboxes.
-    opme_needed = db.Column(db.Boolean, nullable=False)
-    special_opme = db.Column(db.Boolean, nullable=False)
-    previous_complications = db.Column(db.Boolean, nullable=False)
+    # Os três checkboxes do formulário são sempre lidos e gravados juntos, então
+    # ficam empacotados em um único SMALLINT de bits ('flags') em vez de três
+    # colunas booleanas: a linha fica mais estreita, cabem mais tuplas por
+    # página e varreduras ficam proporcionalmente mais rápidas. O restante da
+    # aplicação continua usando 'opme_needed' / 'special_opme' /
+    # 'previous_complications' normalmente, via as hybrid properties abaixo.
+    flags = db.Column(db.SmallInteger, nullable=False, default=0)
+
+    # Posição de cada flag dentro do bitmask.
+    _FLAG_OPME_NEEDED = 1
+    _FLAG_SPECIAL_OPME = 2
+    _FLAG_PREVIOUS_COMPLICATIONS = 4
+
+    def _get_flag(self, bit):
+        """Lê um bit do bitmask ('flags' pode ser None antes do flush)."""
+        return bool((self.flags or 0) & bit)
+
+    def _set_flag(self, bit, value):
+        """Liga ou desliga um bit do bitmask."""
+        if value:
+            self.flags = (self.flags or 0) | bit
+        else:
+            self.flags = (self.flags or 0) & ~bit
+
+    @hybrid_property
+    def opme_needed(self):
+        return self._get_flag(self._FLAG_OPME_NEEDED)
+
+    @opme_needed.setter
+    def opme_needed(self, value):
+        self._set_flag(self._FLAG_OPME_NEEDED, value)
+
+    @opme_needed.expression
+    def opme_needed(cls):
+        # Versão SQL: permite consultas como CaseEvaluation.query.filter(
+        # CaseEvaluation.opme_needed).
+        return cls.flags.op('&')(cls._FLAG_OPME_NEEDED) != 0
+
+    @hybrid_property
+    def special_opme(self):
+        return self._get_flag(self._FLAG_SPECIAL_OPME)
+
+    @special_opme.setter
+    def special_opme(self, value):
+        self._set_flag(self._FLAG_SPECIAL_OPME, value)
+
+    @special_opme.expression
+    def special_opme(cls):
+        return cls.flags.op('&')(cls._FLAG_SPECIAL_OPME) != 0
+
+    @hybrid_property
+    def previous_complications(self):
+        return self._get_flag(self._FLAG_PREVIOUS_COMPLICATIONS)
+
+    @previous_complications.setter
+    def previous_complications(self, value):
+        self._set_flag(self._FLAG_PREVIOUS_COMPLICATIONS, value)
+
+    @previous_complications.expression
+    def previous_complications(cls):
+        return cls.flags.op('&')(cls._FLAG_PREVIOUS_COMPLICATIONS) != 0
+
+    # Lado reverso do relacionamento ('.patient'). 'lazy='raise_on_sql'' faz a
+    # navegação filho→pai levantar um erro se ela precisar ir ao banco: um
+    # detector de cargas "N+1" acidentais — quem precisar do pai deve
+    # carregá-lo explicitamente na consulta.
+    patient = db.relationship('FormResponse', back_populates='case_evaluation', lazy='raise_on_sql')
 
 # ---------------------------------------------------------------------------
 # MODELO: Authorization
@@ -110,15 +391,51 @@ class CaseEvaluation(db.Model):
 # ---------------------------------------------------------------------------
 class Authorization(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False)
+    # 'unique=True': relacionamento um-para-um garantido também no banco;
+    # o índice único atende às buscas por paciente como consultas pontuais
+    # (ver o comentário em CaseEvaluation.patient_id).
+    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False, unique=True)
     
     opme_authorization = db.Column(db.Boolean, nullable=False)
     
     # Campos de data e hora que podem ser nulos (caso ainda não tenham sido definidos).
     scheduling_date = db.Column(db.Date, nullable=True)
-    execution_date = db.Column(db.Date, nullable=True)
-    execution_time = db.Column(db.Time, nullable=True)
-    cancellation_reason = db.Column(db.Text, nullable=True)
+
+    # 'execution_at': data E hora da realização em uma única coluna TIMESTAMP
+    # WITH TIME ZONE, no lugar do antigo par Date + Time. Com duas colunas, um
+    # filtro por intervalo ("execuções entre ontem 9h e hoje 17h") precisava
+    # combinar as duas e não aproveitava índice nenhum; com uma coluna única e
+    # indexada, vira uma varredura de faixa em um só B-tree. O fuso na coluna
+    # evita ambiguidade de horário ao mudar o servidor de região.
+    execution_at = db.Column(db.TIMESTAMP(timezone=True), nullable=True, index=True)
+
+    # Compatibilidade: o restante da aplicação (templates do resumo) continua
+    # lendo 'execution_date' e 'execution_time' separadamente. As hybrid
+    # properties derivam os dois do timestamp único — em Python para
+    # instâncias, e como expressão SQL para consultas.
+    @hybrid_property
+    def execution_date(self):
+        return self.execution_at.date() if self.execution_at is not None else None
+
+    @execution_date.expression
+    def execution_date(cls):
+        return db.func.date(cls.execution_at)
+
+    @hybrid_property
+    def execution_time(self):
+        return self.execution_at.time() if self.execution_at is not None else None
+
+    @execution_time.expression
+    def execution_time(cls):
+        return db.cast(cls.execution_at, db.Time)
+    # Texto longo, fora das consultas de lista (ver 'diagnosis' em FormResponse).
+    cancellation_reason = deferred(db.Column(db.Text, nullable=True), group='clinical_text')
+
+    # Lado reverso do relacionamento ('.patient'). 'lazy='raise_on_sql'' faz a
+    # navegação filho→pai levantar um erro se ela precisar ir ao banco: um
+    # detector de cargas "N+1" acidentais — quem precisar do pai deve
+    # carregá-lo explicitamente na consulta.
+    patient = db.relationship('FormResponse', back_populates='authorization', lazy='raise_on_sql')
 
 # ---------------------------------------------------------------------------
 # MODELO: ProcedureExecution
@@ -126,19 +443,136 @@ class Authorization(db.Model):
 # ---------------------------------------------------------------------------
 class ProcedureExecution(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False)
+    # 'unique=True': relacionamento um-para-um garantido também no banco;
+    # o índice único atende às buscas por paciente como consultas pontuais
+    # (ver o comentário em CaseEvaluation.patient_id).
+    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False, unique=True)
     
     execution_date = db.Column(db.Date, nullable=False)
-    medical_report = db.Column(db.Text, nullable=True)
+    # Texto longo, fora das consultas de lista (ver 'diagnosis' em FormResponse).
+    medical_report = deferred(db.Column(db.Text, nullable=True), group='clinical_text')
     patient_informed = db.Column(db.Boolean, nullable=False)
     previous_complications = db.Column(db.Boolean, nullable=False)
 
+    # Lado reverso do relacionamento ('.patient'). 'lazy='raise_on_sql'' faz a
+    # navegação filho→pai levantar um erro se ela precisar ir ao banco: um
+    # detector de cargas "N+1" acidentais — quem precisar do pai deve
+    # carregá-lo explicitamente na consulta.
+    patient = db.relationship('FormResponse', back_populates='procedure_execution', lazy='raise_on_sql')
+
 # ---------------------------------------------------------------------------
 # MODELO: FollowUp
 # DESCRIÇÃO: Armazena os dados do formulário "Acompanhamento Pós-Procedimento".
 # ---------------------------------------------------------------------------
 class FollowUp(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False)
+    # 'unique=True': relacionamento um-para-um garantido também no banco;
+    # o índice único atende às buscas por paciente como consultas pontuais
+    # (ver o comentário em CaseEvaluation.patient_id).
+    patient_id = db.Column(db.Integer, db.ForeignKey('form_response.id'), nullable=False, unique=True)
     
     post_procedure_complications = db.Column(db.Boolean, nullable=False)
+
+    # Lado reverso do relacionamento ('.patient'). 'lazy='raise_on_sql'' faz a
+    # navegação filho→pai levantar um erro se ela precisar ir ao banco: um
+    # detector de cargas "N+1" acidentais — quem precisar do pai deve
+    # carregá-lo explicitamente na consulta.
+    patient = db.relationship('FormResponse', back_populates='follow_up', lazy='raise_on_sql')
+
+# Índice funcional (só PostgreSQL) sobre o telefone normalizado: o campo
+# 'patient_contact' chega da planilha sem padrão ("(11) 99999-9999",
+# "11999999999", ...). O índice guarda só os dígitos, então uma busca por
+# telefone no formato "WHERE regexp_replace(patient_contact, '\D', '', 'g') =
+# :digitos" vira uma consulta de árvore B em vez de varrer a tabela aplicando a
+# função linha a linha. Criado via DDL condicional porque o SQLite não tem
+# 'regexp_replace'.
+event.listen(
+    FormResponse.__table__, 'after_create',
+    DDL(
+        "CREATE INDEX IF NOT EXISTS ix_form_response_contact_digits "
+        "ON form_response (regexp_replace(patient_contact, '\\D', '', 'g'))"
+    ).execute_if(dialect='postgresql')
+)
+
+# ---------------------------------------------------------------------------
+# MANUTENÇÃO AUTOMÁTICA DE FormResponse.workflow_stage
+# ---------------------------------------------------------------------------
+# Cada tabela de etapa corresponde a um número de estágio. Ao inserir um
+# registro de etapa, o estágio do paciente sobe para o número correspondente —
+# mas só se ele for maior que o atual, já que as rotas dos formulários são
+# alcançáveis pela URL em qualquer ordem. Ao remover, a etapa mais avançada
+# restante é recalculada a partir das tabelas de etapa, em vez de apenas
+# decrementar. Os listeners usam a conexão do próprio flush, então a
+# atualização participa da mesma transação.
+
+_WORKFLOW_STAGES = (
+    (CaseEvaluation, 1),
+    (Authorization, 2),
+    (ProcedureExecution, 3),
+    (FollowUp, 4),
+)
+
+def _remaining_stage_expr(patient_id):
+    """
+    Expressão SQL com a etapa mais avançada que o paciente ainda possui: um
+    CASE que testa as tabelas de etapa da mais avançada para a mais inicial
+    (o primeiro EXISTS verdadeiro responde) e cai em 0 se não restar nenhuma.
+    """
+    return case(
+        *(
+            (exists().where(model.patient_id == patient_id), stage)
+            for model, stage in reversed(_WORKFLOW_STAGES)
+        ),
+        else_=0,
+    )
+
+def _register_workflow_stage_listeners(model, stage):
+    """Registra os listeners de inserção/remoção para uma tabela de etapa."""
+
+    @event.listens_for(model, 'after_insert')
+    def _bump_stage(mapper, connection, target):
+        connection.execute(
+            FormResponse.__table__.update()
+            .where(FormResponse.id == target.patient_id)
+            # Só sobe: completar uma etapa anterior depois de uma posterior
+            # não pode rebaixar o estágio já alcançado.
+            .where(FormResponse.workflow_stage < stage)
+            .values(workflow_stage=stage)
+        )
+
+    @event.listens_for(model, 'after_delete')
+    def _drop_stage(mapper, connection, target):
+        connection.execute(
+            FormResponse.__table__.update()
+            .where(FormResponse.id == target.patient_id)
+            .values(workflow_stage=_remaining_stage_expr(target.patient_id))
+        )
+
+for _model, _stage in _WORKFLOW_STAGES:
+    _register_workflow_stage_listeners(_model, _stage)
+
+# ---------------------------------------------------------------------------
+# FLAGS DE ETAPA CONCLUÍDA (calculadas pelo banco)
+# ---------------------------------------------------------------------------
+# Cada flag 'has_*' é um booleano vindo de um subselect "EXISTS (...)" na
+# própria consulta do paciente — o banco responde só 4 bits em vez de 4 linhas
+# completas das tabelas filhas. São 'deferred': consultas que não precisam das
+# flags (ex: rotas de formulário) não pagam pelos subselects; a listagem de
+# pacientes as habilita com 'undefer'. Definidas aqui no fim do arquivo porque
+# as expressões referenciam os modelos filhos.
+
+FormResponse.has_case_evaluation = column_property(
+    select(exists().where(CaseEvaluation.patient_id == FormResponse.id)).scalar_subquery(),
+    deferred=True)
+
+FormResponse.has_authorization = column_property(
+    select(exists().where(Authorization.patient_id == FormResponse.id)).scalar_subquery(),
+    deferred=True)
+
+FormResponse.has_procedure_execution = column_property(
+    select(exists().where(ProcedureExecution.patient_id == FormResponse.id)).scalar_subquery(),
+    deferred=True)
+
+FormResponse.has_follow_up = column_property(
+    select(exists().where(FollowUp.patient_id == FormResponse.id)).scalar_subquery(),
+    deferred=True)